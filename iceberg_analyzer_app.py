@@ -1,31 +1,82 @@
 import streamlit as st
+import pandas as pd
+import io
+import re
+import math
+import time
+import random
 import json
+import string
+import hashlib
+import uuid
+import collections
+import concurrent.futures
+from snowflake.snowpark import functions as F
+from snowflake.snowpark.functions import col
+from snowflake.snowpark.types import StringType
+from snowflake.snowpark.exceptions import SnowparkSQLException
 
 try:
-    from snowflake.snowpark.context import get_active_session
-    session = get_active_session()
-except:
-    from snowflake.snowpark import Session
-    session = Session.builder.config('connection_name', 'default').create()
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
+
+@st.cache_resource
+def get_session():
+    try:
+        from snowflake.snowpark.context import get_active_session
+        session = get_active_session()
+    except:
+        from snowflake.snowpark import Session
+        session = Session.builder.config('connection_name', 'default').create()
+    session.cte_optimization_enabled = True
+    return session
+
+session = get_session()
 
 st.title("🧊 Iceberg Readiness Audit")
 st.caption("Analyze your Snowflake database for Apache Iceberg compatibility")
 
 
 
-@st.cache_data(ttl=300)
+@st.cache_data(ttl=3600)
 def get_databases():
-    result = session.sql("SHOW DATABASES").collect()
-    return [row["name"] for row in result]
+    return session.sql("SHOW DATABASES").to_pandas()["name"].tolist()
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def get_schema_overview(_session, database_name):
+    query = f"""
+    SELECT TABLE_SCHEMA, COUNT(*) AS TABLE_COUNT
+    FROM {database_name}.INFORMATION_SCHEMA.TABLES
+    WHERE TABLE_TYPE = 'BASE TABLE'
+    GROUP BY TABLE_SCHEMA
+    ORDER BY TABLE_SCHEMA
+    """
+    schema_counts = _session.sql(query).to_pandas()
+    # Derived here so widget reruns reuse the cached list instead of rebuilding it
+    return schema_counts["TABLE_SCHEMA"].tolist(), int(schema_counts["TABLE_COUNT"].sum())
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def get_table_index(_session, database_name, schema_name=None):
+    schema_filter = "AND TABLE_SCHEMA = ?" if schema_name else ""
+    query = f"""
+    SELECT TABLE_SCHEMA, TABLE_NAME, IS_TRANSIENT, CLUSTERING_KEY
+    FROM {database_name}.INFORMATION_SCHEMA.TABLES
+    WHERE TABLE_TYPE = 'BASE TABLE'
+    {schema_filter}
+    ORDER BY TABLE_SCHEMA, TABLE_NAME
+    """
+    params = [schema_name] if schema_name else None
+    return _session.sql(query, params=params).to_pandas()
 
-@st.cache_data(ttl=60)
-def get_table_metadata(_session, database_name):
+# Deliberately not cached: COLUMNS_INFO dominates the metadata size and is only
+# needed while an analysis runs.
+def get_table_columns(_session, database_name, schema_name=None):
+    schema_filter = "AND c.TABLE_SCHEMA = ? AND t.TABLE_SCHEMA = ?" if schema_name else ""
     query = f"""
     SELECT 
         c.TABLE_SCHEMA,
         c.TABLE_NAME,
-        t.IS_TRANSIENT,
-        t.CLUSTERING_KEY,
         ARRAY_AGG(
             OBJECT_CONSTRUCT(
                 'column', c.COLUMN_NAME,
@@ -39,14 +90,40 @@ def get_table_metadata(_session, database_name):
         ON c.TABLE_SCHEMA = t.TABLE_SCHEMA 
         AND c.TABLE_NAME = t.TABLE_NAME
     WHERE t.TABLE_TYPE = 'BASE TABLE'
-    GROUP BY c.TABLE_SCHEMA, c.TABLE_NAME, t.IS_TRANSIENT, t.CLUSTERING_KEY
+    {schema_filter}
+    GROUP BY c.TABLE_SCHEMA, c.TABLE_NAME
     """
-    return _session.sql(query).to_pandas()
+    params = [schema_name, schema_name] if schema_name else None
+    columns_df = _session.sql(query, params=params).to_pandas()
+    # VARIANT columns arrive as pretty-printed JSON text
+    columns_df["COLUMNS_INFO"] = columns_df["COLUMNS_INFO"].apply(json_loads)
+    return columns_df
+
+CORTEX_MODEL = "mistral-large2"
+ANALYSIS_BATCH_SIZE = 25
+STAGED_INPUT_MIN_ROWS = 500
+
+try:
+    CORTEX_MAX_WORKERS = int(st.secrets.get("cortex_max_workers", 16))
+except Exception:
+    CORTEX_MAX_WORKERS = 16
+
+CORTEX_TEMPERATURE = 0
+CORTEX_MAX_TOKENS = 400
+
+CORTEX_RETRY_ATTEMPTS = 3
+CORTEX_TIMEOUT_SECONDS_PER_TABLE = 12
+CORTEX_SUMMARY_TIMEOUT_SECONDS = 120
+STATEMENT_TIMEOUT_ERROR_CODE = 630
+
+COMPACT_JSON = json.JSONEncoder(separators=(",", ":"))
+
+AUDIT_CACHE_TABLE = "ICEBERG_AUDIT_CACHE"
+AUDIT_CACHE_TTL_DAYS = 7
 
-def analyze_table_with_ai(_session, schema_name, table_name, is_transient, clustering_key, columns_info):
-    prompt = f"""You are a Snowflake data engineer. Analyze if this table is suitable for migration to Apache Iceberg format.
+ICEBERG_RULES = """You are a Snowflake data engineer. The user sends one table's metadata as JSON (schema, table, is_transient, clustering_key, columns). Decide if the table is suitable for migration to Apache Iceberg format.
 
-ICEBERG DATA TYPE LIMITATIONS:
+ICEBERG LIMITATIONS:
 - VARIANT columns NOT supported (must convert to structured OBJECT/ARRAY/MAP)
 - Semi-structured ARRAY and OBJECT must be structured types with defined schemas
 - GEOGRAPHY and GEOMETRY types NOT supported
@@ -55,31 +132,201 @@ ICEBERG DATA TYPE LIMITATIONS:
 - Timestamp precision limited to microseconds (6), nanoseconds will truncate
 - Temporary and transient tables NOT supported
 
-FEATURE COMPARISON (Native vs Iceberg Managed vs Iceberg External):
-| Feature              | Native | Managed | External |
-|----------------------|--------|---------|----------|
-| Fail-safe            | Yes    | No      | No       |
-| Collation            | Yes    | No      | No       |
-| Snowpipe Streaming   | Yes    | No      | No       |
-| Automatic Clustering | Yes    | Yes     | No       |
-| Replication          | Yes    | No      | No       |
-| Time Travel          | 90 days| Yes     | Limited  |
+FEATURES LOST (Managed / External): Fail-safe (lost / lost), Collation (lost / lost), Snowpipe Streaming (lost / lost), Replication (lost / lost), Automatic Clustering (kept / lost), Time Travel (kept / limited).
+If the table has clustering keys and needs clustering, External Iceberg is NOT suitable.
+
+Respond with raw JSON only, no markdown:
+{"suitable": true/false, "target": "MANAGED or EXTERNAL", "blockers": ["list"], "feature_loss": ["list"], "warnings": ["list"], "recommendation": "brief recommendation"}"""
+
+# Part of every cache fingerprint, so editing the rules invalidates cached verdicts
+ICEBERG_RULES_HASH = hashlib.sha256(ICEBERG_RULES.encode()).hexdigest()
+
+def with_cortex_retry(func, *args, **kwargs):
+    # Transient Cortex failures (throttling, 503s) surface as SQL errors; retry with
+    # jittered exponential backoff so one blip doesn't lose a whole batch. Statement
+    # timeouts are not transient, and retrying them only holds the worker longer.
+    for attempt in range(CORTEX_RETRY_ATTEMPTS):
+        try:
+            return func(*args, **kwargs)
+        except SnowparkSQLException as e:
+            if attempt == CORTEX_RETRY_ATTEMPTS - 1 or e.sql_error_code == STATEMENT_TIMEOUT_ERROR_CODE:
+                raise
+            time.sleep(min(2 ** attempt, 10) + random.uniform(0, 1))
+
+def analysis_inputs(tables_df):
+    return tables_df.assign(COLUMNS_INFO=tables_df["COLUMNS_INFO"].apply(COMPACT_JSON.encode))
+
+def stage_analysis_inputs(_session, tables_df):
+    # One compressed PUT + COPY for every pending table, instead of an upload per batch
+    return _session.write_pandas(
+        analysis_inputs(tables_df),
+        f"TMP_ICEBERG_PROMPTS_{uuid.uuid4().hex.upper()}",
+        auto_create_table=True,
+        overwrite=True,
+        table_type="temporary",
+        use_logical_type=True
+    )
+
+def analyze_tables_with_ai(tables, timeout_seconds):
+    # One Cortex query for every table: the static rules travel as the system
+    # message and each table is a compact JSON user message built in SQL, so
+    # no table metadata is ever spliced into the query text.
+    payload = F.to_json(F.object_construct(
+        F.lit("schema"), col("TABLE_SCHEMA"),
+        F.lit("table"), col("TABLE_NAME"),
+        F.lit("is_transient"), col("IS_TRANSIENT"),
+        F.lit("clustering_key"), F.coalesce(col("CLUSTERING_KEY"), F.lit("none")),
+        F.lit("columns"), F.parse_json(col("COLUMNS_INFO")),
+    ))
+    messages = F.array_construct(
+        F.object_construct(F.lit("role"), F.lit("system"), F.lit("content"), F.lit(ICEBERG_RULES)),
+        F.object_construct(F.lit("role"), F.lit("user"), F.lit("content"), payload),
+    )
+    options = F.object_construct(
+        F.lit("temperature"), F.lit(CORTEX_TEMPERATURE),
+        F.lit("max_tokens"), F.lit(CORTEX_MAX_TOKENS),
+    )
+    # TRY_COMPLETE returns NULL for a row Cortex rejects instead of failing the whole
+    # batch; those rows come back as UNKNOWN through the normal parse fallback.
+    completion = F.call_function("SNOWFLAKE.CORTEX.TRY_COMPLETE", F.lit(CORTEX_MODEL), messages, options)
+    return tables.select(
+        col("TABLE_SCHEMA"),
+        col("TABLE_NAME"),
+        col("CLUSTERING_KEY"),
+        col("FINGERPRINT"),
+        # With options, TRY_COMPLETE returns its JSON response as a string
+        F.parse_json(completion)["choices"][0]["messages"].cast(StringType()).alias("RESULT"),
+    ).to_pandas(statement_params={"STATEMENT_TIMEOUT_IN_SECONDS": timeout_seconds})
+
+MARKDOWN_FENCE = re.compile(r"^```(?:json)?|```$", re.M)
+
+def parse_analysis_result(ai_result):
+    cleaned_result = MARKDOWN_FENCE.sub("", ai_result.strip()).strip()
+
+    try:
+        parsed = json_loads(cleaned_result)
+    except:
+        parsed = None
+
+    # A bare string, number or list is valid JSON but not an analysis
+    if not isinstance(parsed, dict):
+        return {"suitable": None, "target": "UNKNOWN", "blockers": [], "feature_loss": [], "warnings": [], "recommendation": cleaned_result}
+    return parsed
+
+def parse_analysis_results(ai_results):
+    ai_results = ai_results.fillna("")
+    # JSON never needs a raw newline, so folding them to spaces leaves one
+    # response per line and the whole batch parses as a single NDJSON document.
+    lines = ai_results.str.strip().str.replace(MARKDOWN_FENCE, "", regex=True).str.strip().str.replace(r"[\r\n]+", " ", regex=True)
+    parsed_df = None
+    # read_json happily turns bare strings, numbers or lists into rows with integer
+    # column labels, so only hand it a batch where every line is a JSON object.
+    if lines.str.startswith("{").all():
+        try:
+            parsed_df = pd.read_json(io.StringIO(lines.str.cat(sep="\n")), lines=True, dtype=False, convert_dates=False)
+        except ValueError:
+            pass
+
+    # Any malformed response (or a blank line read_json skipped) falls back to per-row parsing.
+    # Note the fast path shares dtypes across rows, so an integer field missing from some
+    # responses comes back as a float; the analysis schema has no numeric fields.
+    if (
+        parsed_df is None
+        or len(parsed_df) != len(ai_results)
+        or not all(isinstance(label, str) for label in parsed_df.columns)
+    ):
+        return [parse_analysis_result(ai_result) for ai_result in ai_results]
+    return [
+        {key: value for key, value in record.items() if not (isinstance(value, float) and math.isnan(value))}
+        for record in parsed_df.to_dict("records")
+    ]
 
-IMPORTANT: If table has clustering keys and needs clustering, External Iceberg is NOT suitable.
+def table_fingerprint(row):
+    payload = {
+        "model": CORTEX_MODEL,
+        "rules": ICEBERG_RULES_HASH,
+        "temperature": CORTEX_TEMPERATURE,
+        "max_tokens": CORTEX_MAX_TOKENS,
+        "schema": row.TABLE_SCHEMA,
+        "table": row.TABLE_NAME,
+        "is_transient": row.IS_TRANSIENT,
+        "clustering_key": row.CLUSTERING_KEY,
+        "columns_info": row.COLUMNS_INFO,
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
 
-TABLE METADATA:
-Schema: {schema_name}
-Table: {table_name}
-Is Transient: {is_transient}
-Clustering Key: {clustering_key if clustering_key else 'none'}
-Columns: {columns_info}
+def table_result(row, analysis):
+    return {
+        "schema": row.TABLE_SCHEMA,
+        "table": row.TABLE_NAME,
+        "clustering": row.CLUSTERING_KEY or "None",
+        "analysis": analysis
+    }
 
-Respond with raw JSON only. Do NOT include ```json or ``` or any markdown. Start directly with curly brace:
-{{"suitable": true/false, "target": "MANAGED or EXTERNAL", "blockers": ["list"], "feature_loss": ["list"], "warnings": ["list"], "recommendation": "brief recommendation"}}"""
+def get_cached_analyses(_session, fingerprints):
+    _session.sql(f"""
+    CREATE TABLE IF NOT EXISTS {AUDIT_CACHE_TABLE} (
+        FINGERPRINT STRING PRIMARY KEY,
+        RESULT VARIANT,
+        CREATED_AT TIMESTAMP_LTZ DEFAULT CURRENT_TIMESTAMP()
+    )
+    """).collect()
+    cached_df = _session.table(AUDIT_CACHE_TABLE).filter(
+        col("FINGERPRINT").isin(fingerprints)
+        & (col("CREATED_AT") > F.dateadd("day", F.lit(-AUDIT_CACHE_TTL_DAYS), F.current_timestamp()))
+    ).select(col("FINGERPRINT"), col("RESULT")).to_pandas()
+    return {fingerprint: json_loads(result) for fingerprint, result in zip(cached_df["FINGERPRINT"], cached_df["RESULT"])}
 
-    query = f"""SELECT SNOWFLAKE.CORTEX.COMPLETE('mistral-large2', '{prompt.replace("'", "''")}') AS RESULT"""
-    result = _session.sql(query).collect()
-    return result[0]["RESULT"]
+def store_cached_analyses(_session, analyses):
+    source = _session.create_dataframe(
+        [[fingerprint, json.dumps(analysis)] for fingerprint, analysis in analyses.items()],
+        schema=["FINGERPRINT", "RESULT"]
+    )
+    target = _session.table(AUDIT_CACHE_TABLE)
+    target.merge(
+        source,
+        target["FINGERPRINT"] == source["FINGERPRINT"],
+        [
+            F.when_matched().update({"RESULT": F.parse_json(source["RESULT"]), "CREATED_AT": F.current_timestamp()}),
+            F.when_not_matched().insert({"FINGERPRINT": source["FINGERPRINT"], "RESULT": F.parse_json(source["RESULT"]), "CREATED_AT": F.current_timestamp()}),
+        ]
+    )
+
+def run_analysis_batch(_session, batch, staged_inputs=None):
+    if staged_inputs is None:
+        tables = _session.create_dataframe(analysis_inputs(batch))
+    else:
+        tables = staged_inputs.filter(col("FINGERPRINT").isin(batch["FINGERPRINT"].tolist()))
+    result_df = with_cortex_retry(analyze_tables_with_ai, tables, CORTEX_TIMEOUT_SECONDS_PER_TABLE * len(batch))
+    results = []
+    new_analyses = {}
+    analyses = parse_analysis_results(result_df["RESULT"])
+    for row, analysis in zip(result_df.itertuples(index=False), analyses):
+        if analysis.get("suitable") is not None:
+            new_analyses[row.FINGERPRINT] = analysis
+        results.append(table_result(row, analysis))
+
+    # The cache only saves future work; a failed write must not discard fresh
+    # results, so it is handed back for the main thread to report.
+    cache_error = None
+    if new_analyses:
+        try:
+            store_cached_analyses(_session, new_analyses)
+        except Exception as e:
+            cache_error = e
+    return results, cache_error
+
+SUMMARY_PROMPT = string.Template("""Summarize the Iceberg migration readiness assessment for the $database_name database. 
+Do not escape underscores or use backslashes in table names.
+Write a brief section on each of these.  Be specific.
+1. Overall readiness (how many tables are suitable vs not)
+2. Common blockers or issues found across tables
+3. Key recommendations for the migration
+
+Table assessments:
+$table_assessments
+
+Write in a professional tone suitable for a technical report.""")
 
 def generate_summary_paragraph(_session, database_name, results):
     table_summaries = []
@@ -91,174 +338,234 @@ def generate_summary_paragraph(_session, database_name, results):
     
     all_summaries = "\n".join(table_summaries)
     
-    prompt = f"""Summarize the Iceberg migration readiness assessment for the {database_name} database. 
-Do not escape underscores or use backslashes in table names.
-Write a brief section on each of these.  Be specific.
-1. Overall readiness (how many tables are suitable vs not)
-2. Common blockers or issues found across tables
-3. Key recommendations for the migration
+    prompt = SUMMARY_PROMPT.substitute(database_name=database_name, table_assessments=all_summaries)
 
-Table assessments:
-{all_summaries}
+    # Bound parameters keep the query text identical across calls
+    summary_query = _session.sql(
+        "SELECT SNOWFLAKE.CORTEX.COMPLETE(?, ?) AS RESULT", params=[CORTEX_MODEL, prompt]
+    )
+    summary = with_cortex_retry(
+        summary_query.to_pandas, statement_params={"STATEMENT_TIMEOUT_IN_SECONDS": CORTEX_SUMMARY_TIMEOUT_SECONDS}
+    ).iat[0, 0]
+    return summary.replace("\\", "")
 
-Write in a professional tone suitable for a technical report."""
+def results_fingerprint(results):
+    return hashlib.sha256(json.dumps(results, sort_keys=True, default=str).encode()).hexdigest()
+
+# Streamlit hashes only database_name and the precomputed fingerprint, so
+# reruns that leave the results unchanged skip the Cortex call entirely.
+@st.cache_data(ttl=3600, show_spinner=False)
+def get_summary_paragraph(_session, database_name, fingerprint, _results):
+    return generate_summary_paragraph(_session, database_name, _results)
+
+def render_table_result(r):
+    analysis = r["analysis"]
+    suitable = analysis.get("suitable")
+    
+    if suitable == True:
+        icon = "✅"
+    elif suitable == False:
+        icon = "❌"
+    else:
+        icon = "⚠️"
+    
+    with st.expander(f"{icon} {r['schema']}.{r['table']}"):
+        if "error" in analysis:
+            st.error(f"Analysis error: {analysis['error']}")
+        else:
+            col1, col2 = st.columns(2)
+            with col1:
+                st.write(f"**Suitable:** {suitable}")
+                st.write(f"**Target:** {analysis.get('target', 'N/A')}")
+                st.write(f"**Clustering:** {r['clustering']}")
+            
+            with col2:
+                if analysis.get("blockers"):
+                    st.write("**🚫 Blockers:**")
+                    for b in analysis["blockers"]:
+                        st.write(f"  - {b}")
+                
+                if analysis.get("feature_loss"):
+                    st.write("**⚠️ Feature Loss:**")
+                    for f in analysis["feature_loss"]:
+                        st.write(f"  - {f}")
+            
+            if analysis.get("recommendation"):
+                st.info(f"**Recommendation:** {analysis['recommendation']}")
+
+# Fragments rerun on their own, so interacting with the analysis panel or the
+# report does not re-run the database and schema selectors above them.
+# st.fragment is 1.37+; 1.33-1.36 only ship the experimental name.
+fragment = getattr(st, "fragment", None) or st.experimental_fragment
+
+@fragment
+def render_results(results):
+    counts = collections.Counter(r["analysis"].get("suitable") for r in results)
+    suitable_count = counts[True]
+    unsuitable_count = counts[False]
+    unknown_count = len(results) - suitable_count - unsuitable_count
+    
+    st.subheader("📊 Summary")
+    col1, col2, col3 = st.columns(3)
+    col1.metric("✅ Suitable", suitable_count)
+    col2.metric("❌ Not Suitable", unsuitable_count)
+    col3.metric("⚠️ Unknown", unknown_count)
+    
+    results_df = pd.DataFrame([{"schema": r["schema"], "suitable": r["analysis"].get("suitable")} for r in results])
+    schema_summary = results_df.groupby("schema", sort=False)["suitable"].agg(
+        suitable=lambda s: (s == True).sum(),
+        unsuitable=lambda s: (s == False).sum(),
+        total="size",
+    )
+    
+    st.subheader("📁 Schema Overview")
+    for stats in schema_summary.itertuples():
+        pct = (stats.suitable / stats.total * 100) if stats.total > 0 else 0
+        st.progress(pct / 100, text=f"**{stats.Index}**: {stats.suitable}/{stats.total} tables suitable ({pct:.0f}%)")
+    
+    st.subheader("📝 Executive Summary")
+    with st.spinner("Generating summary..."):
+        try:
+            db_name = st.session_state.get("selected_db", "the database")
+            summary_text = get_summary_paragraph(session, db_name, results_fingerprint(results), results)
+            st.write(summary_text)
+        except Exception as e:
+            st.warning(f"Could not generate summary: {e}")
+    
+    st.subheader("📋 Detailed Results")
+    for r in results:
+        render_table_result(r)
+
+@fragment
+def analysis_panel(database_name, schema_name, table_index_df):
+    if st.button("🔍 Analyze Tables for Iceberg Suitability", type="primary"):
+        status = st.status(f"Analyzing {len(table_index_df)} tables with Cortex...", expanded=True)
+        with status:
+            progress_bar = st.progress(0)
+            try:
+                columns_df = get_table_columns(session, database_name, schema_name)
+            except Exception as e:
+                status.update(label="Could not load column metadata", state="error")
+                st.error(f"Error loading metadata: {e}")
+                return
+
+        filtered_df = table_index_df.merge(columns_df, on=["TABLE_SCHEMA", "TABLE_NAME"])
+        if filtered_df.empty:
+            status.update(label="No table columns are visible for the selected schema", state="error")
+            return
+
+        # Results are published to session state as they arrive, so a rerun
+        # mid-analysis still shows everything completed so far.
+        results = []
+        st.session_state["analysis_results"] = results
+        st.session_state["selected_db"] = database_name
+
+        # Expanders can't nest inside st.status, so live results render just below it
+        live_placeholder = st.empty()
+        live_results = live_placeholder.container()
+
+        work_df = filtered_df.assign(FINGERPRINT=[table_fingerprint(row) for row in filtered_df.itertuples(index=False)])
+
+        def publish(new_results):
+            results.extend(new_results)
+            with live_results:
+                for r in new_results:
+                    render_table_result(r)
+            progress_bar.progress(len(results) / len(work_df), text=f"Analyzed {len(results)} of {len(work_df)} tables")
+
+        try:
+            cached = get_cached_analyses(session, work_df["FINGERPRINT"].tolist())
+        except Exception as e:
+            with status:
+                st.warning(f"Analysis cache unavailable, re-analyzing all tables: {e}")
+            cached = {}
+
+        publish([table_result(row, cached[row.FINGERPRINT]) for row in work_df[work_df["FINGERPRINT"].isin(cached)].itertuples(index=False)])
+        pending_df = work_df[~work_df["FINGERPRINT"].isin(cached)]
+
+        staged_inputs = None
+        if len(pending_df) >= STAGED_INPUT_MIN_ROWS:
+            try:
+                staged_inputs = stage_analysis_inputs(session, pending_df)
+            except Exception as e:
+                with status:
+                    st.warning(f"Could not stage analysis inputs, uploading per batch instead: {e}")
+
+        batches = [pending_df.iloc[i:i + ANALYSIS_BATCH_SIZE] for i in range(0, len(pending_df), ANALYSIS_BATCH_SIZE)]
+        cache_write_failed = False
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=CORTEX_MAX_WORKERS)
+        try:
+            futures = {executor.submit(run_analysis_batch, session, batch, staged_inputs): batch for batch in batches}
+            for future in concurrent.futures.as_completed(futures):
+                batch = futures[future]
+                try:
+                    batch_results, cache_error = future.result()
+                except Exception as e:
+                    publish([table_result(row, {"suitable": None, "error": str(e)}) for row in batch.itertuples(index=False)])
+                    continue
+
+                publish(batch_results)
+                if cache_error is not None and not cache_write_failed:
+                    cache_write_failed = True
+                    with status:
+                        st.warning(f"Could not update the analysis cache, results will not be reused: {cache_error}")
+        finally:
+            # A Streamlit rerun or stop surfaces as an exception from publish(); don't
+            # block the next run waiting on batches whose results will be discarded.
+            executor.shutdown(wait=False, cancel_futures=True)
+            # The session outlives this run, so the staged temp table would otherwise
+            # survive for the whole app process. A failed drop must not mask the
+            # exception that got us here; the table still ends with the session.
+            if staged_inputs is not None:
+                try:
+                    staged_inputs.drop_table()
+                except Exception:
+                    pass
+
+        # The full report below re-renders every table in order
+        live_placeholder.empty()
+        status.update(label=f"Analyzed {len(results)} tables", state="complete", expanded=False)
+        results.sort(key=lambda r: (r["schema"], r["table"]))
+
+    if st.session_state.get("analysis_results"):
+        render_results(st.session_state["analysis_results"])
 
-    # Change SUMMARIZE to COMPLETE
-    query = f"""SELECT SNOWFLAKE.CORTEX.COMPLETE('mistral-large2', '{prompt.replace("'", "''")}') AS RESULT"""
-    result = _session.sql(query).collect()
-    summary = result[0]["RESULT"]
-    return summary.replace("\\", "")
 databases = get_databases()
 selected_db = st.selectbox("Select Database to Analyze", databases, index=None, placeholder="Choose a database...")
 
 if selected_db:
-    with st.spinner(f"Loading table metadata from {selected_db}..."):
+    with st.spinner(f"Loading schemas from {selected_db}..."):
         try:
-            metadata_df = get_table_metadata(session, selected_db)
+            schemas, total_tables = get_schema_overview(session, selected_db)
         except Exception as e:
             st.error(f"Error loading metadata: {e}")
             st.stop()
     
-    if metadata_df.empty:
+    if not schemas:
         st.warning("No base tables found in this database.")
         st.stop()
     
-    schemas = sorted(metadata_df["TABLE_SCHEMA"].unique())
-    
     col1, col2 = st.columns([1, 3])
     with col1:
-        st.metric("Total Tables", len(metadata_df))
+        st.metric("Total Tables", total_tables)
     with col2:
         st.metric("Schemas", len(schemas))
     
     st.divider()
     
-    selected_schema = st.selectbox("Filter by Schema (optional)", ["All Schemas"] + list(schemas))
+    selected_schema = st.selectbox("Filter by Schema (optional)", ["All Schemas"] + schemas)
     
-    if selected_schema != "All Schemas":
-        filtered_df = metadata_df[metadata_df["TABLE_SCHEMA"] == selected_schema]
-    else:
-        filtered_df = metadata_df
+    # A single schema is filtered inside INFORMATION_SCHEMA rather than after fetching every schema
+    schema_name = None if selected_schema == "All Schemas" else selected_schema
+    with st.spinner(f"Loading table metadata from {selected_db}..."):
+        try:
+            table_index_df = get_table_index(session, selected_db, schema_name)
+        except Exception as e:
+            st.error(f"Error loading metadata: {e}")
+            st.stop()
     
-        if st.button("🔍 Analyze Tables for Iceberg Suitability", type="primary"):
-            results = []
-            progress_bar = st.progress(0)
-            status_text = st.empty()
-            
-            for idx, (_, row) in enumerate(filtered_df.iterrows()):  # ← Use enumerate()
-                progress = (idx + 1) / len(filtered_df)
-                progress_bar.progress(progress)
-                status_text.text(f"Analyzing {row['TABLE_SCHEMA']}.{row['TABLE_NAME']}...")
-            
-            try:
-                ai_result = analyze_table_with_ai(
-                    session,
-                    row["TABLE_SCHEMA"],
-                    row["TABLE_NAME"],
-                    row["IS_TRANSIENT"],
-                    row["CLUSTERING_KEY"],
-                    str(row["COLUMNS_INFO"])
-                )
-                
-                cleaned_result = ai_result.strip()
-                if cleaned_result.startswith("```"):
-                    cleaned_result = cleaned_result.replace("```json", "").replace("```", "").strip()
-                
-                try:
-                    parsed = json.loads(cleaned_result)
-                except:
-                    parsed = {"suitable": None, "target": "UNKNOWN", "blockers": [], "feature_loss": [], "warnings": [], "recommendation": cleaned_result}
-                
-                results.append({
-                    "schema": row["TABLE_SCHEMA"],
-                    "table": row["TABLE_NAME"],
-                    "clustering": row["CLUSTERING_KEY"] or "None",
-                    "analysis": parsed
-                })
-            except Exception as e:
-                results.append({
-                    "schema": row["TABLE_SCHEMA"],
-                    "table": row["TABLE_NAME"],
-                    "clustering": row["CLUSTERING_KEY"] or "None",
-                    "analysis": {"suitable": None, "error": str(e)}
-                })
-        
-            progress_bar.empty()
-            status_text.empty()
-        
-            st.session_state["analysis_results"] = results
-            st.session_state["selected_db"] = selected_db
+    if table_index_df.empty:
+        st.warning("No base tables found in the selected schema.")
+        st.stop()
     
-    if "analysis_results" in st.session_state:
-        results = st.session_state["analysis_results"]
-        
-        suitable_count = sum(1 for r in results if r["analysis"].get("suitable") == True)
-        unsuitable_count = sum(1 for r in results if r["analysis"].get("suitable") == False)
-        unknown_count = len(results) - suitable_count - unsuitable_count
-        
-        st.subheader("📊 Summary")
-        col1, col2, col3 = st.columns(3)
-        col1.metric("✅ Suitable", suitable_count)
-        col2.metric("❌ Not Suitable", unsuitable_count)
-        col3.metric("⚠️ Unknown", unknown_count)
-        
-        schema_summary = {}
-        for r in results:
-            schema = r["schema"]
-            if schema not in schema_summary:
-                schema_summary[schema] = {"suitable": 0, "unsuitable": 0, "total": 0}
-            schema_summary[schema]["total"] += 1
-            if r["analysis"].get("suitable") == True:
-                schema_summary[schema]["suitable"] += 1
-            elif r["analysis"].get("suitable") == False:
-                schema_summary[schema]["unsuitable"] += 1
-        
-        st.subheader("📁 Schema Overview")
-        for schema, stats in schema_summary.items():
-            pct = (stats["suitable"] / stats["total"] * 100) if stats["total"] > 0 else 0
-            st.progress(pct / 100, text=f"**{schema}**: {stats['suitable']}/{stats['total']} tables suitable ({pct:.0f}%)")
-        
-        st.subheader("📝 Executive Summary")
-        with st.spinner("Generating summary..."):
-            try:
-                db_name = st.session_state.get("selected_db", "the database")
-                summary_text = generate_summary_paragraph(session, db_name, results)
-                st.write(summary_text)
-            except Exception as e:
-                st.warning(f"Could not generate summary: {e}")
-        
-        st.subheader("📋 Detailed Results")
-        for r in results:
-            analysis = r["analysis"]
-            suitable = analysis.get("suitable")
-            
-            if suitable == True:
-                icon = "✅"
-            elif suitable == False:
-                icon = "❌"
-            else:
-                icon = "⚠️"
-            
-            with st.expander(f"{icon} {r['schema']}.{r['table']}"):
-                if "error" in analysis:
-                    st.error(f"Analysis error: {analysis['error']}")
-                else:
-                    col1, col2 = st.columns(2)
-                    with col1:
-                        st.write(f"**Suitable:** {suitable}")
-                        st.write(f"**Target:** {analysis.get('target', 'N/A')}")
-                        st.write(f"**Clustering:** {r['clustering']}")
-                    
-                    with col2:
-                        if analysis.get("blockers"):
-                            st.write("**🚫 Blockers:**")
-                            for b in analysis["blockers"]:
-                                st.write(f"  - {b}")
-                        
-                        if analysis.get("feature_loss"):
-                            st.write("**⚠️ Feature Loss:**")
-                            for f in analysis["feature_loss"]:
-                                st.write(f"  - {f}")
-                    
-                    if analysis.get("recommendation"):
-                        st.info(f"**Recommendation:** {analysis['recommendation']}")
+    analysis_panel(selected_db, schema_name, table_index_df)